@@ -8,9 +8,10 @@ gerar_notebook.py  –  benchmark completo DuckDB × formatos de arquivo
 – Cria relatorio.ipynb com texto acadêmico + gráficos
 """
 
-import os, time, shutil
+import os, time, shutil, statistics
 from pathlib import Path
-import duckdb, pandas as pd, nbformat
+from datetime import date
+import duckdb, pandas as pd, pyarrow as pa, nbformat
 from nbformat.v4 import new_notebook, new_markdown_cell, new_code_cell
 from tqdm import tqdm
 
@@ -19,8 +20,21 @@ OUT_DIR        = Path("dados").resolve()
 PARQUET_DIR    = OUT_DIR / "vendas.parquet"
 CSV_FILE       = OUT_DIR / "vendas.csv"
 DUCKDB_FILE    = OUT_DIR / "vendas.duckdb"
+RESULTADO_FILE = OUT_DIR / "resultado.parquet"  # df_res lido pelo notebook
+ESCALA_FILE    = OUT_DIR / "escala.parquet"     # df_esc (threads) lido pelo notebook
 N_LINHAS       = 1_000_000                      # altere p/ 100_000_000 se necessário
-CHUNK          = 250_000                        # linhas por chunk de geração
+CHUNK          = 250_000                        # linhas da amostra usada nas gravações
+REPETICOES     = 5                              # execuções quentes por query (mediana)
+THREADS        = [t for t in (1, 2, 4, 8) if t <= (os.cpu_count() or 1)]   # eixo de paralelismo (≤ nº de cores)
+MEMORIA        = "8GB"                          # PRAGMA memory_limit do DuckDB
+POOL           = 10_000                         # valores distintos (Faker) p/ colunas texto
+PRODUTOS       = ("Console","Jogo","Funko","Controle","Headset")
+CODECS         = [("snappy",None),("lz4",None),("zstd",3),("zstd",10),("gzip",None)] # (codec, nível) Parquet
+CSV_COLUNAS    = {                              # schema explícito → read_csv sem sniffing
+    "id_transacao": "VARCHAR", "data": "DATE", "loja": "VARCHAR", "produto": "VARCHAR",
+    "quantidade": "BIGINT", "preco_unitario": "DOUBLE", "total": "DOUBLE",
+    "cliente": "VARCHAR", "cidade": "VARCHAR", "estado": "VARCHAR",
+}
 QUERIES = {
     "vendas_por_loja": """
         SELECT loja, SUM(total) AS total_loja
@@ -44,10 +58,38 @@ QUERIES = {
         LIMIT 10
     """
 }
+# as 3 queries num único GROUP BY (GROUPING SETS) + top 10 por conjunto via QUALIFY
+# GROUPING(loja, cliente, produto): 3 = por loja, 5 = por cliente, 6 = por produto
+QUERY_UNICA = """
+    SELECT CASE GROUPING(loja, cliente, produto)
+               WHEN 3 THEN 'vendas_por_loja' WHEN 5 THEN 'ticket_medio_cliente' ELSE 'produto_top_qtd'
+           END                                                               AS consulta,
+           COALESCE(loja, cliente, produto)                                  AS chave,
+           CASE GROUPING(loja, cliente, produto)
+               WHEN 3 THEN SUM(total) WHEN 5 THEN AVG(total) ELSE SUM(quantidade)
+           END                                                               AS valor
+    FROM vendas
+    GROUP BY GROUPING SETS ((loja), (cliente), (produto))
+    QUALIFY row_number() OVER (PARTITION BY GROUPING(loja, cliente, produto) ORDER BY valor DESC) <= 10
+"""
+
+# colunas que cada query lê → variante projetada (<query>_proj) lê só essas da fonte
+COLUNAS_QUERY = {
+    "vendas_por_loja":      ["loja", "total"],
+    "ticket_medio_cliente": ["cliente", "total"],
+    "produto_top_qtd":      ["produto", "quantidade"],
+}
+
+# conexão única reaproveitada em geração, gravações e queries (arquivos via ATTACH/VIEW)
+_CON = duckdb.connect(":memory:")
+_CON.execute(f"PRAGMA threads={os.cpu_count()}")
+_CON.execute(f"PRAGMA memory_limit='{MEMORIA}'")
+_CON.execute("SET enable_external_file_cache=true")      # Parquet/CSV relidos da RAM nas execuções quentes
+_CON.execute("SET prefetch_all_parquet_files=true")     # prefetch também p/ arquivos locais
 
 # -------------------- FUNÇÕES AUXILIARES -------------------------------- #
 def gerar_dados():
-    """Gera dataset sintético direto em Parquet particionado se não existir."""
+    """Gera dataset sintético direto em Parquet (SQL dentro do DuckDB) se não existir."""
     if PARQUET_DIR.exists():
         print("✅ Parquet já existe – pulando geração.")
         return
@@ -55,67 +97,116 @@ def gerar_dados():
     fake = Faker("pt_BR")
     Faker.seed(42)
 
+    # Faker só gera pools pequenos; o DuckDB sorteia as N linhas em paralelo
+    pools = {
+        "lojas":    [fake.company()    for _ in range(POOL)],
+        "clientes": [fake.name()       for _ in range(POOL)],
+        "cidades":  [fake.city()       for _ in range(POOL)],
+        "estados":  [fake.state_abbr() for _ in range(POOL)],
+        "produtos": list(PRODUTOS),
+    }
+    inicio = date(date.today().year // 10 * 10, 1, 1)
+    n_dias = (date.today() - inicio).days + 1
+
     PARQUET_DIR.mkdir(parents=True, exist_ok=True)
-    linhas_rest = N_LINHAS
-    part = 0
     print(f"🛠️  Gerando {N_LINHAS:,} linhas em Parquet …")
-    while linhas_rest > 0:
-        n = min(CHUNK, linhas_rest)
-        rows = []
-        for _ in range(n):
-            qtde  = fake.random_int(1, 6)
-            preco = round(fake.random_number(digits=4)/100, 2)
-            rows.append([
-                fake.uuid4(), fake.date_this_decade(), fake.company(),
-                fake.random_element(elements=("Console","Jogo","Funko","Controle","Headset")),
-                qtde, preco, round(qtde*preco,2),
-                fake.name(), fake.city(), fake.state_abbr()
-            ])
-        df = pd.DataFrame(rows, columns=[
-            "id_transacao","data","loja","produto","quantidade",
-            "preco_unitario","total","cliente","cidade","estado"
-        ])
-        df.to_parquet(PARQUET_DIR / f"part_{part:05d}.parquet", index=False)
-        linhas_rest -= n; part += 1
+    _CON.execute("CREATE OR REPLACE TEMP TABLE pools AS SELECT $lojas AS lojas, $clientes AS clientes, "
+                "$cidades AS cidades, $estados AS estados, $produtos AS produtos", pools)
+    # semente do random()/uuid() do DuckDB → mesmos valores a cada geração
+    # (a ordem das linhas no arquivo ainda pode variar com várias threads)
+    _CON.execute("SELECT setseed(0.42)")
+    _CON.execute(f"""
+        COPY (
+            SELECT id_transacao, data, loja, produto, quantidade, preco_unitario,
+                   ROUND(quantidade*preco_unitario, 2) AS total, cliente, cidade, estado
+            FROM (
+                SELECT uuid()::VARCHAR                                                AS id_transacao,
+                       DATE '{inicio}' + CAST(floor(random()*{n_dias}) AS INTEGER)    AS data,
+                       lojas[CAST(floor(random()*{POOL}) AS INTEGER) + 1]             AS loja,
+                       produtos[CAST(floor(random()*{len(PRODUTOS)}) AS INTEGER) + 1] AS produto,
+                       CAST(floor(random()*6) AS BIGINT) + 1                          AS quantidade,
+                       floor(random()*10000) / 100                                    AS preco_unitario,
+                       clientes[CAST(floor(random()*{POOL}) AS INTEGER) + 1]          AS cliente,
+                       cidades[CAST(floor(random()*{POOL}) AS INTEGER) + 1]           AS cidade,
+                       estados[CAST(floor(random()*{POOL}) AS INTEGER) + 1]           AS estado
+                FROM range({N_LINHAS}), pools
+            )
+        ) TO '{PARQUET_DIR / "vendas.parquet"}' (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 122880)
+    """)
+    _CON.execute("DROP TABLE pools")
     print("✅ Dataset Parquet concluído!\n")
 
-def medir_gravacao(df: pd.DataFrame, fmt: str):
-    """Salva o DataFrame em fmt (parquet|csv|duckdb) e devolve (tempo, tamanho)."""
-    start = time.time()
+def _cronometrar(fn) -> float:
+    """Tempo (s) de uma execução de fn, medido com perf_counter_ns."""
+    ini = time.perf_counter_ns()
+    fn()
+    return (time.perf_counter_ns()-ini) / 1e9
+
+def _bench(fn, reps: int = REPETICOES) -> float:
+    """Mediana (s) de reps execuções de fn – chame após 1 execução de aquecimento."""
+    return statistics.median(_cronometrar(fn) for _ in range(reps))
+
+def _tamanho(path: Path) -> int:
+    """Bytes de um arquivo ou diretório (recursivo via os.scandir)."""
+    if path.is_file(): return path.stat().st_size
+    return sum(e.stat().st_size if e.is_file() else _tamanho(Path(e.path)) for e in os.scandir(path))
+
+def medir_gravacao(tbl: pa.Table, fmt: str, codec: tuple | None = None):
+    """Salva a tabela Arrow em fmt (parquet|csv|duckdb) e devolve (tempo, tamanho).
+
+    codec = (compressão, nível) usado só no Parquet; None = zstd-3, nível None = default do codec
+    (o DuckDB só aceita nível p/ zstd).
+    """
+    compressao, nivel = codec or ("zstd", 3)
+    _CON.register("amostra", tbl)              # Arrow → DuckDB sem cópia
+    start = time.perf_counter_ns()
     if fmt=="parquet":
         if PARQUET_DIR.exists(): shutil.rmtree(PARQUET_DIR)
-        PARQUET_DIR.mkdir()
-        df.to_parquet(PARQUET_DIR / "part_00000.parquet", index=False)
+        opt_nivel = f", COMPRESSION_LEVEL {nivel}" if nivel else ""
+        # Hive (estado=XX/) → filtros por estado pulam diretórios inteiros
+        _CON.execute(f"COPY amostra TO '{PARQUET_DIR}' (FORMAT PARQUET, PARTITION_BY (estado), "
+                     f"COMPRESSION {compressao}{opt_nivel}, ROW_GROUP_SIZE 122880)")
         path = PARQUET_DIR
     elif fmt=="csv":
-        df.to_csv(CSV_FILE, index=False)
+        _CON.execute(f"COPY amostra TO '{CSV_FILE}' (FORMAT CSV, HEADER TRUE)")
         path = CSV_FILE
     elif fmt=="duckdb":
+        _CON.execute("DETACH DATABASE IF EXISTS db")
         if DUCKDB_FILE.exists(): DUCKDB_FILE.unlink()
-        con = duckdb.connect(DUCKDB_FILE)
-        con.execute("CREATE TABLE vendas AS SELECT * FROM df")
-        con.close()
+        _CON.execute(f"ATTACH '{DUCKDB_FILE}' AS db")
+        # ordenado por loja → min/max por row group úteis p/ zonemap
+        _CON.execute("CREATE TABLE db.vendas AS SELECT * FROM amostra ORDER BY loja")
+        _CON.execute("CHECKPOINT db")           # grava tudo no arquivo (sem WAL pendente)
         path = DUCKDB_FILE
-    dur = round(time.time()-start,3)
-    size = sum(f.stat().st_size for f in Path(path).rglob("*")) if path.is_dir() else path.stat().st_size
-    return dur, round(size/1024/1024,1)   # MB
+    dur = round((time.perf_counter_ns()-start)/1e9,3)
+    _CON.unregister("amostra")
+    return dur, round(_tamanho(path)/1024/1024,1)   # MB
+
+def executar_queries(fmt: str, threads: int | None = None):
+    """Lê o formato, executa queries (+ consulta_unica e _proj), devolve {'query':frio, 'query_quente':quente}.
 
-def executar_queries(fmt: str):
-    """Lê o formato, executa queries, devolve {'query':tempo}."""
-    con = duckdb.connect(database=":memory:")
+    1ª execução de cada query = fria (e aquecimento); quente = mediana de REPETICOES execuções.
+    threads = PRAGMA threads usado nas queries (None = os.cpu_count()).
+    """
+    _CON.execute(f"PRAGMA threads={threads or os.cpu_count()}")
     if fmt=="parquet":
-        con.execute(f"CREATE VIEW vendas AS SELECT * FROM read_parquet('{PARQUET_DIR}/*.parquet')")
+        fonte = f"read_parquet('{PARQUET_DIR}/**/*.parquet', hive_partitioning=1)"
     elif fmt=="csv":
-        con.execute(f"CREATE VIEW vendas AS SELECT * FROM read_csv_auto('{CSV_FILE}')")
+        fonte = f"read_csv('{CSV_FILE}', header=true, columns={CSV_COLUNAS}, parallel=true)"
     else: # duckdb
-        con.execute(f"ATTACH '{DUCKDB_FILE}' AS db")
-        con.execute("USE db")
+        _CON.execute(f"ATTACH IF NOT EXISTS '{DUCKDB_FILE}' AS db")
+        fonte = "db.vendas"
+    _CON.execute(f"CREATE OR REPLACE VIEW vendas AS SELECT * FROM {fonte}")
+    projetadas = {
+        f"{nome}_proj": QUERIES[nome].replace("FROM vendas", f"FROM (SELECT {', '.join(cols)} FROM {fonte})")
+        for nome, cols in COLUNAS_QUERY.items()
+    }
     tempos = {}
-    for nome, sql in QUERIES.items():
-        ini = time.time()
-        con.execute(sql).fetchall()
-        tempos[nome] = round(time.time()-ini,3)
-    con.close()
+    for nome, sql in {**QUERIES, "consulta_unica": QUERY_UNICA, **projetadas}.items():
+        executar = lambda: _CON.sql(sql).to_arrow_table()     # resultado colunar, sem tuplas Python
+        tempos[nome] = round(_cronometrar(executar),4)
+        tempos[f"{nome}_quente"] = round(_bench(executar),4)
+    _CON.execute(f"PRAGMA threads={os.cpu_count()}")
     return tempos
 
 # -------------------- PIPELINE COMPLETO ---------------------------------- #
@@ -123,24 +214,51 @@ def main():
     OUT_DIR.mkdir(exist_ok=True)
     gerar_dados()
 
-    # carrega 1 partição na RAM (para CSV + DuckDB nativo)
-    df_sample = pd.read_parquet(next(PARQUET_DIR.glob("*.parquet")))
+    # carrega 1 amostra de CHUNK linhas na RAM (para CSV + DuckDB nativo)
+    df_sample = _CON.sql(f"SELECT * FROM read_parquet('{PARQUET_DIR}/**/*.parquet', hive_partitioning=1) LIMIT {CHUNK}").df(date_as_object=True)
+    # produto (5) e estado (27) têm poucos valores → entram no Arrow como dictionary arrays
+    # (o DuckDB grava VARCHAR; loja/cidade/cliente têm até POOL valores e ficam como texto)
+    for c in ("produto","estado"):
+        df_sample[c] = df_sample[c].astype("category")
+    tbl_sample = pa.Table.from_pandas(df_sample, preserve_index=False)   # 1x, fora da medição
 
-    formatos = []
-    for fmt in ["parquet","csv","duckdb"]:
-        print(f"💾 Gravando em {fmt.upper()} …")
-        t_write, size_mb = medir_gravacao(df_sample if fmt!="parquet" else df_sample, fmt)
+    # Parquet entra 1x por codec (varredura), CSV e DuckDB 1x cada
+    variantes = [("parquet", c) for c in CODECS] + [("csv", None), ("duckdb", None)]
+    formatos, escala = [], []
+    for fmt, codec in variantes:
+        nome = fmt.upper() if codec is None else f"PARQUET-{codec[0].upper()}{codec[1] or ''}"
+        print(f"💾 Gravando em {nome} …")
+        t_write, size_mb = medir_gravacao(tbl_sample, fmt, codec)
         print(f"   ✔️  tempo gravação: {t_write}s  |  tamanho: {size_mb} MB")
 
         tempos_q = executar_queries(fmt)
         formatos.append({
-            "Formato": fmt.upper(),
+            "Formato": nome,
             "Write_s": t_write,
             "Size_MB": size_mb,
             **{f"{q}_s": t for q,t in tempos_q.items()}
         })
+        for t in THREADS:
+            escala.append({
+                "Formato": nome,
+                "Threads": t,
+                **{f"{q}_s": v for q,v in executar_queries(fmt, t).items() if q.endswith("_quente")}
+            })   # só quentes: logo após a passada principal nada é frio
     df_res = pd.DataFrame(formatos)
+    df_esc = pd.DataFrame(escala)
     print("\nResumo:\n", df_res)
+    df_res.to_parquet(RESULTADO_FILE, index=False)
+    df_esc.to_parquet(ESCALA_FILE, index=False)
+    res    = df_res.set_index("Formato")
+    res_pq = res[res.index.str.startswith("PARQUET")]
+    esc    = df_esc.pivot(index="Threads", columns="Formato", values="consulta_unica_quente_s")
+    ganho  = esc.loc[min(THREADS)] / esc.loc[max(THREADS)]
+    paralelismo = (
+        f"de {min(THREADS)} p/ {max(THREADS)} threads o maior ganho da consulta única foi "
+        f"{ganho.max():.1f}× ({ganho.idxmax()})" if len(THREADS) > 1
+        else f"máquina com {os.cpu_count()} core – sem varredura de threads"
+    )
+    proj   = res["vendas_por_loja_quente_s"] / res["vendas_por_loja_proj_quente_s"]
 
     # ---------------- monta notebook ------------------------------------ #
     nb = new_notebook()
@@ -153,38 +271,61 @@ def main():
         new_markdown_cell("## 1 | Metodologia\n"
             "- **Dataset**: 1 M linhas sintéticas (Faker), 10 colunas.\n"
             "- **Formatos testados**: Parquet (colunar), CSV (texto plano) e DuckDB nativo (embed).\n"
-            "- **Métricas**: tempo de gravação, tamanho em disco e latência de 3 consultas SQL."),
+            "- **Codecs Parquet**: " + ", ".join(f"{c}{'-'+str(l) if l else ''}" for c,l in CODECS) + ".\n"
+            "- **Métricas**: tempo de gravação, tamanho em disco e latência de 3 consultas SQL, "
+            "separadas, as 3 num único `GROUP BY GROUPING SETS` (`consulta_unica`) e lendo só as colunas "
+            "usadas (`_proj`), "
+            f"1ª execução fria e quente = mediana de {REPETICOES} execuções (cache de arquivos do DuckDB).\n"
+            f"- **Paralelismo**: queries (quentes) repetidas com {', '.join(map(str, THREADS))} threads, "
+            f"limitado aos {os.cpu_count()} cores da máquina (memory_limit {MEMORIA})."),
         new_code_cell(
             "import pandas as pd, matplotlib.pyplot as plt\n"
-            "df = pd.read_json('''" + df_res.to_json(orient='records') + "''')\n"
+            f"df = pd.read_parquet('{os.path.relpath(RESULTADO_FILE)}')\n"
             "df.set_index('Formato', inplace=True)\n"
             "display(df)\n"
             "\n"
             "# gráfico de latência das queries\n"
-            "fig, ax = plt.subplots(figsize=(10,5))\n"
+            "fig, ax = plt.subplots(figsize=(12,5))\n"
             "df[[c for c in df.columns if c.endswith('_s') and c!='Write_s']].plot.bar(ax=ax)\n"
             "ax.set_ylabel('Tempo (s)'); ax.set_title('Latência por Query x Formato')\n"
-            "plt.xticks(rotation=0); plt.grid(axis='y', linestyle='--', alpha=.6)\n"
+            "plt.xticks(rotation=30, ha='right'); plt.grid(axis='y', linestyle='--', alpha=.6)\n"
             "plt.tight_layout()\n"
             "plt.show()\n"
             "\n"
             "# gráfico de tamanho vs write\n"
-            "fig, ax1 = plt.subplots(figsize=(8,4))\n"
+            "fig, ax1 = plt.subplots(figsize=(10,4))\n"
             "df['Size_MB'].plot.bar(ax=ax1, color='grey', alpha=.6, label='Tamanho (MB)')\n"
             "ax1.set_ylabel('MB'); ax1.set_title('Tamanho e Tempo de Gravação')\n"
             "ax2 = ax1.twinx(); df['Write_s'].plot(ax=ax2, color='red', marker='o', label='Write (s)')\n"
             "ax2.set_ylabel('Write (s)')\n"
             "ax1.legend(loc='upper left'); ax2.legend(loc='upper right')\n"
-            "plt.xticks(rotation=0); plt.tight_layout(); plt.show()"
+            "ax1.tick_params(axis='x', rotation=30); plt.tight_layout(); plt.show()"
+        ),
+        new_code_cell(
+            "# escalabilidade: consulta única (quente) x nº de threads\n"
+            f"esc = pd.read_parquet('{os.path.relpath(ESCALA_FILE)}')\n"
+            "display(esc)\n"
+            "fig, ax = plt.subplots(figsize=(10,4))\n"
+            "esc.pivot(index='Threads', columns='Formato', values='consulta_unica_quente_s')"
+            ".plot(ax=ax, marker='o', logx=True, logy=True)\n"
+            f"ax.set_xticks({THREADS}); ax.set_xticklabels({THREADS})\n"
+            "ax.set_ylabel('Tempo (s)'); ax.set_title('Escalabilidade por Threads')\n"
+            "plt.grid(linestyle='--', alpha=.6); plt.tight_layout(); plt.show()"
         ),
         new_markdown_cell(
             "## 2 | Discussão\n"
-            f"- **Parquet** ofereceu melhor equilíbrio entre tamanho ({df_res.loc[0,'Size_MB']} MB) "
-            f"e leitura (≤ {df_res.loc[0,'vendas_por_loja_s']} s).\n"
-            f"- **CSV** apresentou maior tamanho em disco ({df_res.loc[1,'Size_MB']} MB) e maior latência, "
+            f"- **Parquet** ofereceu melhor equilíbrio entre tamanho ({res_pq['Size_MB'].min()}–"
+            f"{res_pq['Size_MB'].max()} MB, conforme o codec) e leitura (≤ {res_pq['vendas_por_loja_s'].max()} s).\n"
+            f"- **Codecs**: menor arquivo com {res_pq['Size_MB'].idxmin()}, gravação mais rápida com "
+            f"{res_pq['Write_s'].idxmin()} e leitura mais rápida com {res_pq['vendas_por_loja_s'].idxmin()}.\n"
+            f"- **CSV** apresentou maior tamanho em disco ({res.loc['CSV','Size_MB']} MB) e maior latência, "
             "confirmando o overhead de texto plano.\n"
             f"- **DuckDB nativo** foi o mais rápido para leitura, porém gera arquivo proprietário "
-            f"({df_res.loc[2,'Size_MB']} MB) – excelente para pipelines internos.\n\n"
+            f"({res.loc['DUCKDB','Size_MB']} MB) – excelente para pipelines internos.\n"
+            f"- **Paralelismo**: {paralelismo}.\n"
+            f"- **Projeção explícita**: ler só `loja, total` mudou vendas_por_loja (quente) em "
+            f"{proj[res_pq.index].mean():.2f}× no Parquet (média dos codecs) e {proj['CSV']:.2f}× no CSV – "
+            "o DuckDB já empurra a projeção para dentro das views.\n\n"
             "### Insights\n"
             "1. **Formato colunar** (Parquet) é o melhor compromisso p/ intercâmbio.\n"
             "2. **DuckDB nativo** sobressai em pipelines internos, eliminando parsing.\n"